@@ -5,215 +5,144 @@
 # - Permite exportar un reporte PDF con notas y estadísticas.
 
 import re
-import io
 import os
-import tempfile
+import sys
+import hashlib
+import json
+import sqlite3
+import multiprocessing
+from contextlib import closing
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 import streamlit as st
 import pandas as pd
 import numpy as np
-from fpdf import FPDF
-import matplotlib.pyplot as plt
-
-# Librerías que se intentarán usar para extracción de texto/imágenes de PDFs
-# Todas son opcionales: el app intentará múltiples estrategias y fallará elegantemente si no están disponibles.
-try:
-    import pdfplumber
-except Exception:
-    pdfplumber = None
-
-try:
-    import fitz  # PyMuPDF
-except Exception:
-    fitz = None
-
-try:
-    import pytesseract
-    from PIL import Image
-except Exception:
-    pytesseract = None
-    Image = None
+# fpdf se importa donde se usa (reporte): sólo hace falta cuando hay resultados,
+# y así el primer render del app no lo paga.
 
-# ----------------------------- UTILIDADES -----------------------------
-
-def parse_key_string(key_str):
-    """Parsea la cadena de claves del formato '1:a, 2:d, 3:e, 4:v, 5:f' a dict {1: 'a', ...}"""
-    key_str = key_str.strip()
-    if not key_str:
-        return {}
-    pairs = re.split(r"[,;]+", key_str)
-    keys = {}
-    for p in pairs:
-        p = p.strip()
-        if not p:
-            continue
-        m = re.match(r"^(\d+)\s*[:\-\)]\s*([a-evfvAEFV])$", p)
-        if not m:
-            # intentar formatos alternativos como '1 a' o '1:a'
-            m = re.match(r"^(\d+)\s*[.:]?\s*([a-e])$", p, re.IGNORECASE)
-        if m:
-            q = int(m.group(1))
-            ans = m.group(2).lower()
-            # normalizar v/f
-            if ans in ("v", "f"):
-                ans = 'v' if ans == 'v' else 'f'
-            keys[q] = ans
-        else:
-            # intentar separado por espacio
-            parts = p.split()
-            if len(parts) == 2 and parts[0].isdigit():
-                keys[int(parts[0])] = parts[1].lower()[0]
-            else:
-                # ignorar si no pudo parsear
-                continue
-    return keys
+from grader import (OCR_WORKERS, clear_ocr_cache, encode_answer_key, encode_detected, get_cached_detection,
+                    pdf_fingerprint, process_one, score_matrix, store_detection)
 
+# ----------------------------- UTILIDADES -----------------------------
 
-def extract_text_with_pdfplumber(pdf_bytes):
-    if not pdfplumber:
-        return ""
-    out = []
-    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-        for page in pdf.pages:
-            try:
-                out.append(page.extract_text() or "")
-            except Exception:
-                out.append("")
-    return "\n".join(out)
-
-
-def render_pdf_pages_to_images(pdf_bytes):
-    """Usa PyMuPDF para renderizar páginas a PIL Images. Retorna lista de PIL.Image o [] si no disponible."""
-    if not fitz:
-        return []
-    imgs = []
-    try:
-        doc = fitz.open(stream=pdf_bytes, filetype='pdf')
-        for page in doc:
-            mat = fitz.Matrix(2, 2)  # render a mayor resolución
-            pix = page.get_pixmap(matrix=mat, alpha=False)
-            img_bytes = pix.tobytes()
-            try:
-                from PIL import Image as PILImage
-                img = PILImage.open(io.BytesIO(img_bytes))
-                imgs.append(img.convert('RGB'))
-            except Exception:
-                continue
-    except Exception:
-        return []
-    return imgs
+# Una sola regex para toda la cadena de claves: cada par va entre separadores (, o ;)
+# y admite '1:a' / '1-a' / '1)a' (a-f, v), '1.a' / '1 a' (a-e) o '1 <palabra>' (su inicial).
+_KEY_PAIR_RE = re.compile(
+    r"(?:^|[,;])\s*(\d+)"
+    r"(?:\s*[:\-\)]\s*(?P<sep>[a-evfvAEFV])"
+    r"|\s*[.:]?\s*(?P<alt>[a-eA-E])"
+    r"|\s+(?P<word>[^\s,;])[^\s,;]*)"
+    r"\s*(?=[,;]|\Z)"
+)
 
 
-def ocr_image_to_text(img):
-    if not pytesseract:
-        return ""
-    try:
-        return pytesseract.image_to_string(img, lang='eng')
-    except Exception:
-        return ""
+def parse_key_string(key_str: str) -> dict:
+    """Parsea la cadena de claves del formato '1:a, 2:d, 3:e, 4:v, 5:f' a dict {1: 'a', ...}
+    Los pares que no se reconocen se ignoran.
+    """
+    keys = {}
+    for m in _KEY_PAIR_RE.finditer(key_str):
+        ans = m.group('sep') or m.group('alt') or m.group('word')
+        keys[int(m.group(1))] = ans.lower()[0]
+    return keys
 
 
-def find_answers_in_text(text):
-    """Busca patrones de respuesta dentro del texto extraido.
-    Retorna dict {preg: alternatica} detectadas.
-    Soporta formatos comunes como '1. a) X', '1) X a', '1. X a)'.
-    """
-    answers = {}
-    if not text:
-        return answers
-
-    # Normalizar guiones y paréntesis
-    text = text.replace('\r', '\n')
-
-    # Regexes para capturar líneas como "1. a) X b)" o "1 a) X" o "1. X a)"
-    # Buscaremos tres cosas: número de pregunta, la alternativa marcada (a-e o v/f)
-
-    # 1) Buscar patrones tipo '1. a) b) c) d) e) -- con X o similar cerca'
-    # Buscaremos por cada pregunta número las opciones con alguna marca
-    # Build a simple token list
-    tokens = re.split(r"[\n\t]+", text)
-
-    # Pattern to find explicit '1 a) X' type
-    for line in tokens:
-        # buscar número de pregunta al inicio
-        m = re.match(r"^\s*(\d{1,3})\b(.*)$", line)
-        if not m:
-            continue
-        qnum = int(m.group(1))
-        rest = m.group(2)
-        # buscar 'X' o 'x' o '○' o 'o' cerca de opción
-        # ejemplos: 'a) X', 'X a)', 'a) (X)'
-        # construir patrones para cada alternativa a-e y v,f
-        for opt in ['a','b','c','d','e','v','f']:
-            # varias variantes
-            pat1 = rf"{opt}\)\s*[^A-Za-z0-9\S]*[Xx○o●]"  # 'a) X'
-            pat2 = rf"[Xx○o●]\s*{opt}\)"  # 'X a)'
-            pat3 = rf"{opt}\)\s*\([^)]*[Xx○o●]"  # 'a) (X)'
-            if re.search(pat1, rest) or re.search(pat2, rest) or re.search(pat3, rest):
-                answers[qnum] = opt
-                break
-        # si no se detectó, intentar buscar '1. X a)'
-        if qnum not in answers:
-            m2 = re.search(r"[Xx○o●]" , rest)
-            if m2:
-                # intentar encontrar letra más cercana a la X
-                # localizar posiciones
-                pos = m2.start()
-                # buscar letras a-e o v/f en un radio cercano
-                window = rest[max(0,pos-12):pos+12]
-                mm = re.search(r"([a-evfv])\)" , window, re.IGNORECASE)
-                if mm:
-                    answers[qnum] = mm.group(1).lower()
-    # Como alternativa, buscar en todo texto patrones '1:a' '1: a X'
-    # patrones tipo '1: a X' o '1-a X'
-    extra = re.findall(r"(\d{1,3})\s*[:\-\)]\s*([a-evfv])\b.*?[Xx○o●]", text, re.IGNORECASE)
-    for q, opt in extra:
-        answers[int(q)] = opt.lower()
-
-    return answers
-
-
-def grade_single_pdf(pdf_bytes, answer_key):
-    """Devuelve dict con las respuestas detectadas y la nota en 0-20 (no penaliza)."""
-    # 1) Intentar extraer texto
-    text = extract_text_with_pdfplumber(pdf_bytes) if pdfplumber else ""
-    detected = find_answers_in_text(text)
-
-    # 2) Si no detectó nada o detectó pocas preguntas, intentar OCR de imágenes
-    if len(detected) < max(1, len(answer_key)//2):
-        images = render_pdf_pages_to_images(pdf_bytes)
-        for img in images:
-            ocr_text = ocr_image_to_text(img) if pytesseract and Image else ""
-            if ocr_text:
-                more = find_answers_in_text(ocr_text)
-                for k,v in more.items():
-                    if k not in detected:
-                        detected[k] = v
-            # si ya detectamos todas las claves, podemos salir
-            if len(detected) >= len(answer_key):
-                break
-
-    # 3) Ahora calcular nota: contar correctas sobre total de preguntas en la clave
-    total_q = len(answer_key)
-    if total_q == 0:
-        nota = 0.0
-    else:
-        correct = 0
-        for q, correct_ans in answer_key.items():
-            student_ans = detected.get(q)
-            if student_ans == correct_ans:
-                correct += 1
-        nota = (correct / total_q) * 20.0
-        nota = round(nota, 2)
-
-    return {
-        'detected': detected,
-        'score': nota,
-        'correct_count': sum(1 for q in answer_key if detected.get(q)==answer_key[q]),
-        'total': total_q
-    }
+# Cada PDF se procesa en su propio proceso: pdfplumber es Python puro y no
+# escala con hilos. 'fork' porque Streamlit registra este script como __main__ y
+# con 'spawn' cada worker lo volvería a ejecutar completo.
+# CPUs que este proceso puede usar (en Docker, las del contenedor, no las del host)
+MAX_WORKERS = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+# 'fork' sólo en Linux: en macOS hacer fork de un proceso con hilos no es seguro
+# (por eso CPython usa 'spawn' ahí). Sin fork se usan hilos en vez de procesos.
+_MP_CONTEXT = multiprocessing.get_context('fork') if sys.platform.startswith('linux') else None
+
+
+def _pdf_executor(workers):
+    if _MP_CONTEXT is not None:
+        return ProcessPoolExecutor(max_workers=workers, mp_context=_MP_CONTEXT)
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+# Lotes analizados persistidos en SQLite: un refresh o un error de navegación no
+# obliga a re-calificar. El ID depende del contenido de los PDFs y de la clave.
+RUNS_DB = "runs.db"
+# Nota mínima aprobatoria por defecto (formulario y lotes guardados sin ese dato)
+MIN_APROB = 14.0
+
+
+def batch_id_for(pdf_hash, key_str):
+    """ID del lote a partir de un sha256 que ya recibió los bytes de cada PDF (en orden de subida)."""
+    pdf_hash.update(key_str.encode())
+    return pdf_hash.hexdigest()[:16]
+
+
+def save_batch(batch_id, payload):
+    with closing(sqlite3.connect(RUNS_DB)) as conn, conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS runs (batch_id TEXT PRIMARY KEY, created TEXT, payload TEXT)")
+        conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?)",
+                     (batch_id, datetime.now().isoformat(timespec='seconds'), json.dumps(payload)))
+
+
+def load_batch(batch_id):
+    """Retorna el payload guardado para batch_id, o None si no existe."""
+    if not os.path.exists(RUNS_DB):
+        return None
+    with closing(sqlite3.connect(RUNS_DB)) as conn:
+        try:
+            row = conn.execute("SELECT payload FROM runs WHERE batch_id = ?", (batch_id,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+    if row is None:
+        return None
+    payload = json.loads(row[0])
+    # JSON convierte las claves numéricas de pregunta en strings
+    for r in payload['results']:
+        r['detected'] = {int(q): a for q, a in r['detected'].items()}
+    return payload
+
+
+# Reporte PDF: Streamlit re-ejecuta el script en cada interacción y el botón de descarga
+# necesita los bytes ya generados; se arma una vez por lote/curso y se reutiliza.
+@st.cache_data(show_spinner=False, max_entries=8)
+def generate_report_pdf(results_list, course_name, course_code, min_aprob):
+    """Reporte PDF (bytes) con notas por PDF y resumen de estadísticas."""
+    from fpdf import FPDF
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    pdf.set_font('helvetica', 'B', 16)
+    pdf.cell(0,10, 'Exam Auto Grader - Reporte', new_x='LMARGIN', new_y='NEXT', align='C')
+    pdf.set_font('helvetica', '', 10)
+    pdf.cell(0,6, f'Curso: {course_name}    Codigo: {course_code}    Fecha: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}', new_x='LMARGIN', new_y='NEXT')
+    pdf.ln(4)
+
+    # Tabla de notas: fpdf2 arma todas las filas con anchos fijos (60/30/30/30 mm)
+    pdf.set_font('helvetica','',10)
+    with pdf.table(width=150, col_widths=(60,30,30,30), align='LEFT', text_align='LEFT', line_height=8) as table:
+        table.row(('PDF', 'Nota', 'Correctas', 'Total'))
+        for r in results_list:
+            table.row((r['filename'][:40], str(r['score']), str(r['correct_count']), str(r['total'])))
+
+    # Stats summary
+    notas = np.array([r['score'] for r in results_list])
+    promedio = round(notas.mean(),2)
+    mayor = notas.max()
+    menor = notas.min()
+    n_aprobados = int((notas >= min_aprob).sum())
+
+    pdf.ln(6)
+    pdf.set_font('helvetica','B',12)
+    pdf.cell(0,6,'Resumen de Estadísticas', new_x='LMARGIN', new_y='NEXT')
+    pdf.set_font('helvetica','',11)
+    pdf.cell(0,6, f'Promedio general: {promedio}', new_x='LMARGIN', new_y='NEXT')
+    pdf.cell(0,6, f'Mayor nota: {mayor}', new_x='LMARGIN', new_y='NEXT')
+    pdf.cell(0,6, f'Menor nota: {menor}', new_x='LMARGIN', new_y='NEXT')
+    pdf.cell(0,6, f'Aprobados: {n_aprobados} / {len(notas)}', new_x='LMARGIN', new_y='NEXT')
+
+    # En memoria, sin archivo temporal
+    return bytes(pdf.output())
 
 # ----------------------------- STREAMLIT UI -----------------------------
 
@@ -221,6 +150,25 @@ st.set_page_config(page_title="Exam Auto Grader - Simulación n8n", layout='wide
 st.title("Exam Auto Grader — Simulación n8n")
 st.caption("Procesa PDFs de exámenes (marcas X o círculo). Escala 0-20. Nota mínima aprobatoria: 14")
 
+if st.sidebar.button('Limpiar caché OCR'):
+    clear_ocr_cache()
+    st.sidebar.success('Caché OCR vaciada')
+
+# Recuperar un lote ya analizado (?batch=<id> en la URL o escrito en la barra lateral)
+batch_input = st.sidebar.text_input('ID de lote guardado', value=st.query_params.get('batch', '')).strip()
+if batch_input and batch_input != st.session_state.get('batch_id'):
+    saved = load_batch(batch_input)
+    if saved is None:
+        st.sidebar.warning('No hay un lote guardado con ese ID')
+    else:
+        st.session_state.resultados = saved['results']
+        st.session_state.batch_id = batch_input
+        # Curso, clave y nota mínima del lote guardado (no los que haya en el formulario)
+        st.session_state.lote = {'course_name': saved['course_name'], 'course_code': saved['course_code'],
+                                 'key_input': saved.get('key_input', ''),
+                                 'min_aprob': saved.get('min_aprob', MIN_APROB)}
+        st.sidebar.success(f"Lote recuperado: {saved['course_name']} ({saved['course_code']})")
+
 with st.form(key='key_form'):
     col1, col2 = st.columns([3,1])
     with col1:
@@ -229,7 +177,7 @@ with st.form(key='key_form'):
         key_input = st.text_input('Clave de respuestas (ej: 1:a, 2:d, 3:e, 4:v, 5:f)')
     with col2:
         st.markdown('''**Configuración**\n- Escala: 0-20\n- Aprobación: 14\n- Máx PDFs: 30''')
-        min_aprob = st.number_input('Nota mínima aprobatoria', value=14.0, step=0.5)
+        min_aprob = st.number_input('Nota mínima aprobatoria', value=MIN_APROB, step=0.5)
     submitted = st.form_submit_button('Guardar clave')
 
 if submitted:
@@ -251,7 +199,8 @@ if uploaded:
 # Área de simulación n8n
 simulate_col = st.container()
 
-results = []
+# Los resultados viven en session_state para sobrevivir a los reruns de Streamlit
+results = st.session_state.get('resultados', [])
 
 # Botón simulado que 'conecta' con n8n (pero en realidad todo corre localmente)
 if st.button('Analizar en n8n (simulado)'):
@@ -263,49 +212,107 @@ if st.button('Analizar en n8n (simulado)'):
         progress_bar = st.progress(0)
         log_area = st.empty()
         total = len(uploaded)
-        for i, up in enumerate(uploaded, start=1):
-            # leer bytes
-            pdf_bytes = up.read()
-            # procesar
-            res = grade_single_pdf(pdf_bytes, answer_key)
-            res['filename'] = up.name
-            results.append(res)
-            # update fake logs and progress
-            log_area.text(f"Procesando {up.name} ({i}/{total}) — usando modelo: Google Gemini 1.5 (simulado)")
-            progress = int(i/total * 100)
-            progress_bar.progress(progress)
+        # Conservar el orden de subida aunque los PDFs terminen en otro orden
+        ordered = [None] * total
+        # Matriz alumnos x preguntas (códigos uint8): cada fila se llena al llegar su detección
+        questions, key_arr = encode_answer_key(answer_key)
+        det_mat = np.empty((total, len(questions)), dtype=np.uint8)
+        # PDFs ya analizados con esta clave salen de la caché sin tocar el pool;
+        # PDFs idénticos dentro del lote se analizan una sola vez
+        pending = {}  # fingerprint -> (nombre, bytes, [índices en el lote])
+        batch_hash = hashlib.sha256()  # ID del lote: se alimenta en la misma pasada por los PDFs
+        for idx, up in enumerate(uploaded):
+            pdf_bytes = up.getvalue()
+            batch_hash.update(pdf_bytes)
+            fingerprint = pdf_fingerprint(pdf_bytes, answer_key)
+            if fingerprint in pending:
+                pending[fingerprint][2].append(idx)
+                continue
+            detected = get_cached_detection(fingerprint)
+            if detected is None:
+                pending[fingerprint] = (up.name, pdf_bytes, [idx])
+            else:
+                ordered[idx] = {'filename': up.name, 'detected': detected}
+                det_mat[idx] = encode_detected(detected, questions)
+        done = total - sum(len(idxs) for _, _, idxs in pending.values())
+        if pending:
+            workers = min(MAX_WORKERS, len(pending))
+            # cada proceso lanza su propio OCR por páginas: repartir los núcleos entre procesos
+            ocr_workers = min(OCR_WORKERS, max(1, MAX_WORKERS // workers))
+            with _pdf_executor(workers) as ex:
+                futures = {ex.submit(process_one, name, pdf_bytes, answer_key, ocr_workers): fingerprint
+                           for fingerprint, (name, pdf_bytes, _) in pending.items()}
+                for fut in as_completed(futures):
+                    fingerprint = futures[fut]
+                    res = fut.result()
+                    # Sólo se cachea un resultado completo: si el OCR falló o no había
+                    # motor, el próximo análisis debe volver a intentarlo
+                    if res['complete']:
+                        store_detection(fingerprint, res['detected'])
+                    idxs = pending[fingerprint][2]
+                    det_mat[idxs] = encode_detected(res['detected'], questions)
+                    for idx in idxs:
+                        ordered[idx] = {'filename': uploaded[idx].name, 'detected': res['detected']}
+                    done += len(idxs)
+                    # update fake logs and progress
+                    log_area.text(f"Procesado {res['filename']} ({done}/{total}) — usando modelo: Google Gemini 1.5 (simulado)")
+                    progress = int(done/total * 100)
+                    progress_bar.progress(progress)
+        # Calificar todo el lote en una sola comparación vectorizada
+        correct, scores = score_matrix(det_mat, key_arr)
+        for r, c, nota in zip(ordered, correct, scores):
+            r.update(score=float(nota), correct_count=int(c), total=len(answer_key))
+        results = ordered
         progress_bar.progress(100)
-        st.success('Análisis completado (simulado en n8n)')
+        batch_id = batch_id_for(batch_hash, key_input or "")
+        lote = {'course_name': course_name, 'course_code': course_code, 'key_input': key_input or "",
+                'min_aprob': min_aprob}
+        save_batch(batch_id, {**lote, 'results': results})
+        st.session_state.resultados = results
+        st.session_state.lote = lote
+        st.session_state.batch_id = batch_id
+        st.query_params['batch'] = batch_id
+        st.success(f'Análisis completado (simulado en n8n) — ID de lote: {batch_id}')
 
 # Si ya hay resultados (por haber corrido el análisis), mostrar tabla
 if results:
-    df = pd.DataFrame([{'pdf': r['filename'], 'nota': r['score'], 'correctas': r['correct_count'], 'total': r['total']} for r in results])
+    # Datos del lote mostrado (analizado o recuperado); editar el formulario después no los cambia
+    lote = st.session_state.get('lote') or {'course_name': course_name, 'course_code': course_code,
+                                             'key_input': key_input or "", 'min_aprob': min_aprob}
+    # Columnas armadas directamente como arrays tipados (sin lista de dicts ni inferencia de tipos)
+    n = len(results)
+    df = pd.DataFrame({
+        'pdf': [r['filename'] for r in results],
+        'nota': np.fromiter((r['score'] for r in results), dtype=np.float64, count=n),
+        'correctas': np.fromiter((r['correct_count'] for r in results), dtype=np.int16, count=n),
+        'total': np.fromiter((r['total'] for r in results), dtype=np.int16, count=n),
+    })
     st.subheader('Resultados individuales')
     st.dataframe(df.sort_values('nota', ascending=False))
 
     # Estadísticas
-    promedio = round(df['nota'].mean(),2)
-    aprobados = df[df['nota']>=min_aprob]
-    desaprobados = df[df['nota']<min_aprob]
-    pct_aprob = round(len(aprobados)/len(df)*100,2) if len(df)>0 else 0
-    mayor = df['nota'].max()
-    menor = df['nota'].min()
+    notas = df['nota'].to_numpy()
+    passed = notas >= lote['min_aprob']  # una sola máscara para todas las métricas
+    n_aprobados = int(passed.sum())
+    promedio = round(notas.mean(),2)
+    pct_aprob = round(n_aprobados/len(notas)*100,2) if len(notas)>0 else 0
+    mayor = notas.max()
+    menor = notas.min()
 
     col1, col2, col3, col4 = st.columns(4)
     col1.metric('Promedio general', promedio)
-    col2.metric('Promedio aprobados', round(aprobados['nota'].mean(),2) if len(aprobados)>0 else 0)
+    col2.metric('Promedio aprobados', round(notas[passed].mean(),2) if n_aprobados>0 else 0)
     col3.metric('% Aprobados', f"{pct_aprob}%")
     col4.metric('Mayor / Menor', f"{mayor} / {menor}")
 
     st.markdown('---')
 
-    # Histogram
-    fig, ax = plt.subplots(figsize=(6,3))
-    ax.hist(df['nota'], bins=10)
-    ax.set_title('Distribución de notas')
-    ax.set_xlabel('Nota (0-20)')
-    ax.set_ylabel('Cantidad de PDFs')
-    st.pyplot(fig)
+    # Histograma: conteo con numpy y gráfico nativo de Streamlit (sin figura de matplotlib)
+    counts, edges = np.histogram(notas, bins=10, range=(0, 20))
+    centers = (edges[:-1] + edges[1:]) / 2
+    st.markdown('**Distribución de notas**')
+    st.bar_chart(pd.DataFrame({'Cantidad de PDFs': counts}, index=pd.Index(centers, name='Nota (0-20)')),
+                 x_label='Nota (0-20)', y_label='Cantidad de PDFs')
 
     # Mostrar lista detallada con respuestas detectadas
     expander = st.expander('Ver detealles por PDF')
@@ -315,55 +322,9 @@ if results:
             st.write('Respuestas detectadas:', r['detected'])
 
     # Botón para exportar reporte en PDF
-    def generate_report_pdf(results_list, key, course_name, course_code, min_aprob):
-        pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
-        pdf.add_page()
-        pdf.set_font('Arial', 'B', 16)
-        pdf.cell(0,10, f'Exam Auto Grader - Reporte', ln=True, align='C')
-        pdf.set_font('Arial', '', 10)
-        pdf.cell(0,6, f'Curso: {course_name}    Codigo: {course_code}    Fecha: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}', ln=True)
-        pdf.ln(4)
-
-        # Tabla de notas
-        pdf.set_font('Arial','B',12)
-        pdf.cell(60,8,'PDF',1)
-        pdf.cell(30,8,'Nota',1)
-        pdf.cell(30,8,'Correctas',1)
-        pdf.cell(30,8,'Total',1)
-        pdf.ln()
-        pdf.set_font('Arial','',10)
-        for r in results_list:
-            pdf.cell(60,8, r['filename'][:40],1)
-            pdf.cell(30,8, str(r['score']),1)
-            pdf.cell(30,8, str(r['correct_count']),1)
-            pdf.cell(30,8, str(r['total']),1)
-            pdf.ln()
-
-        # Stats summary
-        df2 = pd.DataFrame([{'nota': r['score']} for r in results_list])
-        promedio = round(df2['nota'].mean(),2)
-        mayor = df2['nota'].max()
-        menor = df2['nota'].min()
-        aprobados = df2[df2['nota']>=min_aprob]
-
-        pdf.ln(6)
-        pdf.set_font('Arial','B',12)
-        pdf.cell(0,6,'Resumen de Estadísticas', ln=True)
-        pdf.set_font('Arial','',11)
-        pdf.cell(0,6, f'Promedio general: {promedio}', ln=True)
-        pdf.cell(0,6, f'Mayor nota: {mayor}', ln=True)
-        pdf.cell(0,6, f'Menor nota: {menor}', ln=True)
-        pdf.cell(0,6, f'Aprobados: {len(aprobados)} / {len(df2)}', ln=True)
-
-        # Guardar temporalmente
-        tmpf = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        pdf.output(tmpf.name)
-        return tmpf.name
-
-    report_file = generate_report_pdf(results, answer_key, course_name, course_code, min_aprob)
-    with open(report_file, 'rb') as f:
-        st.download_button('Descargar reporte PDF', data=f, file_name=f"reporte_{course_code}.pdf", mime='application/pdf')
+    report_bytes = generate_report_pdf(results, lote['course_name'], lote['course_code'], lote['min_aprob'])
+    st.download_button('Descargar reporte PDF', data=report_bytes, file_name=f"reporte_{lote['course_code']}.pdf",
+                       mime='application/pdf')
 
     st.info('El reporte incluye: notas por PDF, estadísticas (promedio, mayor, menor) y conteo aprobados/desaprobados.')
 
@@ -0,0 +1,443 @@
+# grader.py
+# Lado "worker" del calificador: extracción de texto/OCR de un PDF, detección de
+# respuestas y cálculo de notas. Vive fuera de app.py para que los procesos del
+# pool puedan importarlo (Streamlit ejecuta app.py como un __main__ falso).
+
+import re
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Librerías que se intentarán usar para extracción de texto/imágenes de PDFs
+# Todas son opcionales: el app intentará múltiples estrategias y fallará elegantemente si no están disponibles.
+try:
+    import pdfplumber
+except Exception:
+    pdfplumber = None
+
+try:
+    import fitz  # PyMuPDF
+except Exception:
+    fitz = None
+
+try:
+    import pytesseract
+except Exception:
+    pytesseract = None
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+try:
+    import diskcache
+except Exception:
+    diskcache = None
+
+# Cachés en disco (opcionales, sobreviven reinicios del app), todas bajo un mismo
+# directorio configurable con la variable de entorno GRADER_CACHE_DIR.
+CACHE_DIR = os.environ.get("GRADER_CACHE_DIR", ".ocr_cache")
+
+# Texto OCR por imagen de página
+OCR_CACHE_DIR = os.path.join(CACHE_DIR, "ocr")
+OCR_CACHE_EXPIRE = 30 * 86400  # segundos
+_OCR_CACHE = diskcache.Cache(OCR_CACHE_DIR) if diskcache else None
+
+# Caché de respuestas detectadas por PDF (hash del contenido + clave). app.py la
+# consulta antes de despachar al pool: un PDF ya visto no vuelve a pdfplumber/OCR.
+# Memoria (LRU) compartida entre sesiones del servidor + disco opcional.
+DETECTION_CACHE_DIR = os.path.join(CACHE_DIR, "detections")
+DETECTION_CACHE_MAX_ENTRIES = 512
+# Versión de la lógica de detección: entra en pdf_fingerprint, así que al subirla
+# las respuestas cacheadas con la lógica anterior dejan de usarse.
+DETECTOR_VERSION = 1
+_DETECTION_DISK = diskcache.Cache(DETECTION_CACHE_DIR) if diskcache else None
+_detection_memo = OrderedDict()
+_detection_lock = threading.Lock()
+
+# Tesseract en un solo hilo por proceso: paralelizamos por página (ver OCR_WORKERS),
+# que rinde más que varios hilos OpenMP compitiendo dentro de cada instancia.
+# OCR_WORKERS es el máximo por PDF; con varios PDFs en paralelo app.py reparte
+# los núcleos (ocr_workers) para no lanzar más Tesseracts que CPUs.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+OCR_WORKERS = 4
+
+# Regexes compiladas una sola vez (se usan por cada línea de cada página de cada PDF)
+_MARKS = "[Xx○o●]"
+# Líneas que empiezan con número de pregunta, en una sola pasada sobre todo el texto
+# (saltos de línea y tabs separan líneas)
+_QUESTION_LINE_RE = re.compile(r"(?:^|(?<=\t))[^\S\n\t]*(\d{1,3})\b([^\n\t]*)", re.MULTILINE)
+# Una sola pasada por línea: 'a) X' | 'X a)' | 'a) (X)'; gana la marca más a la izquierda
+_OPTION_MARK_RE = re.compile(
+    rf"(?P<opt1>[a-fv])\)\s*[^A-Za-z0-9\S]*{_MARKS}"
+    rf"|{_MARKS}\s*(?P<opt2>[a-fv])\)"
+    rf"|(?P<opt3>[a-fv])\)\s*\([^)]*{_MARKS}"
+)
+_MARK_RE = re.compile(_MARKS)
+# Bloque de texto que puede contener una respuesta: algún número y alguna marca.
+# Sin distinguir mayúsculas, igual que _INLINE_ANSWER_RE (que también lee 'O').
+_DIGIT_RE = re.compile(r"\d")
+_BLOCK_MARK_RE = re.compile(_MARKS, re.IGNORECASE)
+_OPTION_NEAR_MARK_RE = re.compile(r"([a-evfv])\)", re.IGNORECASE)
+_INLINE_ANSWER_RE = re.compile(rf"(\d{{1,3}})\s*[:\-\)]\s*([a-evfv])\b.*?{_MARKS}", re.IGNORECASE)
+
+
+# Tope de caracteres extraídos por PDF: una hoja de respuestas cabe de sobra y
+# evita leer (y escanear con regex) documentos enormes completos.
+MAX_TEXT_CHARS = 50000
+# Una página con menos caracteres que esto se considera escaneada (sin capa de texto)
+MIN_PAGE_TEXT_CHARS = 30
+
+
+def extract_pages_with_fitz(doc, max_chars: int = MAX_TEXT_CHARS):
+    """Texto por página de un documento PyMuPDF ya abierto, hasta max_chars en total.
+    Sólo conserva los bloques con número y marca (encabezados, instrucciones, etc. no
+    llegan a las regex). Retorna (textos, nº de caracteres de cada página sin filtrar).
+    """
+    out = []
+    page_chars = []
+    remaining = max_chars
+    for page in doc:
+        try:
+            blocks = page.get_text('blocks')
+        except Exception:
+            blocks = []
+        # b = (x0, y0, x1, y1, texto, nº bloque, tipo); tipo 1 = imagen
+        texts = [b[4] for b in blocks if b[6] == 0]
+        page_chars.append(sum(len(t.strip()) for t in texts))
+        ptext = "\n".join(t for t in texts if _DIGIT_RE.search(t) and _BLOCK_MARK_RE.search(t))
+        out.append(ptext[:remaining])
+        remaining -= len(ptext) + 1
+        if remaining <= 0:
+            break
+    return out, page_chars
+
+
+def extract_pages_with_pdfplumber(pdf_bytes: bytes, max_chars: int = MAX_TEXT_CHARS) -> list:
+    """Texto por página (lista) hasta max_chars en total."""
+    if not pdfplumber:
+        return []
+    out = []
+    remaining = max_chars
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        for page in pdf.pages:
+            try:
+                ptext = page.extract_text() or ""
+            except Exception:
+                ptext = ""
+            # liberar los objetos de layout de la página apenas tenemos su texto
+            page.flush_cache()
+            out.append(ptext[:remaining])
+            remaining -= len(ptext) + 1
+            if remaining <= 0:
+                break
+    return out
+
+
+# Recorte a la zona con tinta antes del OCR: se descartan los márgenes en blanco
+# de la hoja, que Tesseract igual tendría que recorrer.
+INK_THRESHOLD = 128
+CROP_MARGIN_PX = 16
+
+
+def crop_to_ink(arr, threshold=INK_THRESHOLD, margin=CROP_MARGIN_PX):
+    """Recorta un array en escala de grises al rectángulo que contiene tinta (+ margen).
+    Retorna el array original si la página está en blanco.
+    """
+    ink = arr < threshold
+    rows = np.flatnonzero(ink.sum(axis=1) > 1)
+    cols = np.flatnonzero(ink.sum(axis=0) > 1)
+    if rows.size == 0 or cols.size == 0:
+        return arr
+    r0 = max(int(rows[0]) - margin, 0)
+    r1 = min(int(rows[-1]) + margin + 1, arr.shape[0])
+    c0 = max(int(cols[0]) - margin, 0)
+    c1 = min(int(cols[-1]) + margin + 1, arr.shape[1])
+    return arr[r0:r1, c0:c1]
+
+
+def render_pdf_pages_to_images(doc, text_pages=()):
+    """Renderiza las páginas de un documento PyMuPDF abierto a PIL Images en escala de grises ('L').
+    Generador: cada página se rasteriza recién cuando se pide; no produce nada si no hay PIL.
+    Cada página se recorta a su zona con tinta (crop_to_ink).
+    Las páginas en text_pages (índices 0-based que ya tienen capa de texto) se renderizan al final.
+    """
+    if not Image:
+        return
+    try:
+        deferred = set(text_pages)
+        order = [i for i in range(len(doc)) if i not in deferred] + [i for i in range(len(doc)) if i in deferred]
+        for i in order:
+            page = doc[i]
+            mat = fitz.Matrix(2, 2)  # 144 DPI: suficiente para detectar marcas
+            # Escala de grises directo del buffer de píxeles: sin codificar/decodificar PNG
+            pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False)
+            arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+            del pix
+            yield Image.fromarray(crop_to_ink(arr))
+    except Exception:
+        return
+
+
+# Binarizado previo al OCR: las marcas X/círculo no necesitan grises y Tesseract
+# trabaja menos. --psm 6 = bloque uniforme (hoja de respuestas), --oem 1 = sólo LSTM.
+# La imagen ya llega negro sobre blanco (no hace falta probar inversión) y las
+# respuestas no son palabras de diccionario, así que se apagan ambos pasos.
+# La lista blanca limita los caracteres a lo que leen las regex de respuestas
+# (números, opciones a-f/v, marcas y separadores).
+OCR_BINARIZE_THRESHOLD = 180
+OCR_CHAR_WHITELIST = "0123456789abcdefvABCDEFVXxo○●():.-"
+TESSERACT_CONFIG = (
+    '--psm 6 --oem 1 -c tessedit_do_invert=0 -c tessedit_enable_dict_correction=0'
+    f' -c tessedit_char_whitelist={OCR_CHAR_WHITELIST}'
+)
+
+
+def binarize_image(img, threshold=OCR_BINARIZE_THRESHOLD):
+    """Convierte a blanco y negro puro (modo '1') con un umbral fijo."""
+    if img.mode != 'L':
+        img = img.convert('L')
+    return img.point(lambda p: 255 if p > threshold else 0, mode='1')
+
+
+def ocr_image_to_text(img, lang='eng'):
+    """OCR de una imagen. Cachea el texto en disco por SHA-256 de los píxeles.
+    Retorna None si Tesseract no pudo leerla (sin motor, binario ausente, error del proceso).
+    """
+    if not pytesseract:
+        return None
+    img = binarize_image(img)
+    key = None
+    if _OCR_CACHE is not None:
+        h = hashlib.sha256(f"{lang}\x00{TESSERACT_CONFIG}\x00{img.mode}\x00{img.size}\x00".encode())
+        h.update(img.tobytes())
+        key = h.hexdigest()
+        cached = _OCR_CACHE.get(key)
+        if cached is not None:
+            return cached
+    try:
+        text = pytesseract.image_to_string(img, lang=lang, config=TESSERACT_CONFIG)
+    except Exception:
+        return None
+    if key is not None:
+        _OCR_CACHE.set(key, text, expire=OCR_CACHE_EXPIRE)
+    return text
+
+
+def clear_ocr_cache():
+    """Vacía el texto OCR cacheado y las respuestas detectadas por PDF."""
+    if _OCR_CACHE is not None:
+        _OCR_CACHE.clear()
+    if _DETECTION_DISK is not None:
+        _DETECTION_DISK.clear()
+    with _detection_lock:
+        _detection_memo.clear()
+
+
+def pdf_fingerprint(pdf_bytes, answer_key):
+    """Clave de caché de un PDF: blake2b de la versión del detector + el contenido + la clave de respuestas."""
+    h = hashlib.blake2b(f"detector-v{DETECTOR_VERSION}\x00".encode(), digest_size=16)
+    h.update(pdf_bytes)
+    h.update(repr(sorted(answer_key.items())).encode())
+    return h.hexdigest()
+
+
+def _remember_detection(fingerprint, detected):
+    with _detection_lock:
+        _detection_memo[fingerprint] = detected
+        _detection_memo.move_to_end(fingerprint)
+        while len(_detection_memo) > DETECTION_CACHE_MAX_ENTRIES:
+            _detection_memo.popitem(last=False)
+
+
+def get_cached_detection(fingerprint):
+    """Respuestas detectadas antes para este fingerprint, o None."""
+    with _detection_lock:
+        detected = _detection_memo.get(fingerprint)
+        if detected is not None:
+            _detection_memo.move_to_end(fingerprint)
+    if detected is None and _DETECTION_DISK is not None:
+        detected = _DETECTION_DISK.get(fingerprint)
+        if detected is not None:
+            _remember_detection(fingerprint, detected)
+    return dict(detected) if detected is not None else None
+
+
+def store_detection(fingerprint, detected):
+    _remember_detection(fingerprint, dict(detected))
+    if _DETECTION_DISK is not None:
+        _DETECTION_DISK.set(fingerprint, dict(detected), expire=OCR_CACHE_EXPIRE)
+
+
+def find_answers_in_text(text):
+    """Busca patrones de respuesta dentro del texto extraido.
+    Retorna dict {preg: alternatica} detectadas.
+    Soporta formatos comunes como '1. a) X', '1) X a', '1. X a)'.
+    """
+    answers = {}
+    if not text:
+        return answers
+
+    # Normalizar guiones y paréntesis
+    text = text.replace('\r', '\n')
+
+    # Regexes para capturar líneas como "1. a) X b)" o "1 a) X" o "1. X a)"
+    # Buscaremos tres cosas: número de pregunta, la alternativa marcada (a-e o v/f)
+
+    # 1) Buscar patrones tipo '1. a) b) c) d) e) -- con X o similar cerca'
+    # Buscaremos por cada pregunta número las opciones con alguna marca
+
+    # Pattern to find explicit '1 a) X' type
+    # el motor de regex recorre el texto una vez y sólo entrega líneas numeradas
+    for m in _QUESTION_LINE_RE.finditer(text):
+        qnum = int(m.group(1))
+        rest = m.group(2)
+        # sin ninguna marca en la línea no puede haber respuesta: descartarla barato
+        mark = _MARK_RE.search(rest)
+        if not mark:
+            continue
+        # buscar 'X' o 'x' o '○' o 'o' cerca de opción
+        # ejemplos: 'a) X', 'X a)', 'a) (X)'
+        om = _OPTION_MARK_RE.search(rest)
+        if om:
+            answers[qnum] = om['opt1'] or om['opt2'] or om['opt3']
+        # si no se detectó, intentar buscar '1. X a)'
+        elif qnum not in answers:
+            # intentar encontrar letra más cercana a la primera marca (la del filtro de arriba)
+            pos = mark.start()
+            # buscar letras a-e o v/f en un radio cercano
+            window = rest[max(0,pos-12):pos+12]
+            mm = _OPTION_NEAR_MARK_RE.search(window)
+            if mm:
+                answers[qnum] = mm.group(1).lower()
+    # Como alternativa, buscar en todo texto patrones '1:a' '1: a X'
+    # patrones tipo '1: a X' o '1-a X'
+    extra = _INLINE_ANSWER_RE.findall(text)
+    for q, opt in extra:
+        answers[int(q)] = opt.lower()
+
+    return answers
+
+
+def key_hits(detected, answer_key):
+    """Cuenta cuántas preguntas de la clave tienen respuesta detectada."""
+    return sum(1 for q in answer_key if q in detected)
+
+
+def detect_pdf_answers(pdf_bytes, answer_key, ocr_workers=OCR_WORKERS):
+    """Devuelve (dict {pregunta: alternativa}, completo) detectado en el PDF (texto y, si hace falta, OCR).
+    completo es False si hacía falta OCR y no se pudo hacer (sin motor o alguna página falló):
+    ese resultado no debe cachearse.
+    El PDF se abre una sola vez con PyMuPDF: de ahí salen el texto y, si hace falta, las imágenes.
+    ocr_workers = páginas que se pasan a Tesseract a la vez.
+    """
+    doc = None
+    if fitz:
+        try:
+            doc = fitz.open(stream=pdf_bytes, filetype='pdf')
+        except Exception:
+            doc = None
+    if doc is None:
+        # Sin PyMuPDF no hay render para OCR: sólo queda el texto de pdfplumber
+        page_texts = extract_pages_with_pdfplumber(pdf_bytes) if pdfplumber else []
+        detected = find_answers_in_text("\n".join(page_texts))
+        return detected, key_hits(detected, answer_key) >= max(1, len(answer_key)//2)
+    with doc:
+        return _detect_in_doc(doc, pdf_bytes, answer_key, ocr_workers)
+
+
+def _detect_in_doc(doc, pdf_bytes, answer_key, ocr_workers):
+    # 1) Texto nativo de PyMuPDF (mismo documento ya abierto)
+    page_texts, page_chars = extract_pages_with_fitz(doc)
+    detected = find_answers_in_text("\n".join(page_texts))
+    min_hits = max(1, len(answer_key)//2)
+
+    # pdfplumber reconstruye las líneas por posición: sólo se usa si el texto de
+    # PyMuPDF no alcanza (p.ej. número y alternativa en bloques distintos). En un
+    # escaneo (ninguna página con capa de texto) no hay nada que reconstruir: directo al OCR.
+    born_digital = any(n >= MIN_PAGE_TEXT_CHARS for n in page_chars)
+    if born_digital and pdfplumber and key_hits(detected, answer_key) < min_hits:
+        plumber_texts = extract_pages_with_pdfplumber(pdf_bytes)
+        plumber_detected = find_answers_in_text("\n".join(plumber_texts))
+        if key_hits(plumber_detected, answer_key) > key_hits(detected, answer_key):
+            detected = plumber_detected
+
+    # 2) Si el texto no cubre ni la mitad de la clave, intentar OCR de imágenes.
+    #    Sin motor OCR no tiene sentido renderizar páginas (y el resultado queda incompleto).
+    if key_hits(detected, answer_key) >= min_hits:
+        return detected, True
+    if not (pytesseract and Image):
+        return detected, False
+    complete = True
+    # Primero las páginas sin capa de texto (escaneadas); las que sí tienen texto
+    # sólo llegan al OCR si aún faltan respuestas (p.ej. marcas dibujadas encima).
+    text_pages = [i for i, n in enumerate(page_chars) if n >= MIN_PAGE_TEXT_CHARS]
+    # Se rasterizan y leen de a ocr_workers páginas; en cuanto están todas las
+    # claves se deja de renderizar (el resto de páginas nunca se rasteriza).
+    with closing(render_pdf_pages_to_images(doc, text_pages)) as pages, \
+            ThreadPoolExecutor(max_workers=ocr_workers) as ex:
+        while key_hits(detected, answer_key) < len(answer_key):
+            window = list(islice(pages, ocr_workers))
+            if not window:
+                break
+            for ocr_text in ex.map(ocr_image_to_text, window):
+                if ocr_text is None:
+                    complete = False
+                elif ocr_text:
+                    more = find_answers_in_text(ocr_text)
+                    for k,v in more.items():
+                        if k not in detected:
+                            detected[k] = v
+
+    return detected, complete
+
+
+# Alternativa "sin respuesta": nunca coincide con una letra de la clave
+NO_ANSWER = '\x00'
+
+
+def _answer_code(ans):
+    """Código uint8 de una alternativa (los caracteres fuera de Latin-1 se topan en 255)."""
+    return min(ord(ans), 255)
+
+
+def encode_answer_key(answer_key):
+    """Clave como (preguntas ordenadas, array uint8 con el código de cada alternativa)."""
+    questions = sorted(answer_key)
+    key_arr = np.fromiter((_answer_code(answer_key[q]) for q in questions), dtype=np.uint8, count=len(questions))
+    return questions, key_arr
+
+
+def encode_detected(detected, questions):
+    """Fila uint8 con la alternativa detectada para cada pregunta (NO_ANSWER si falta)."""
+    return np.fromiter((_answer_code(detected.get(q) or NO_ANSWER) for q in questions),
+                       dtype=np.uint8, count=len(questions))
+
+
+def score_matrix(det_mat, key_arr):
+    """Califica una matriz uint8 alumnos x preguntas contra la clave (escala 0-20, no penaliza).
+    Una sola comparación por broadcast; retorna (correctas, notas) como arrays.
+    """
+    n = det_mat.shape[0]
+    total_q = key_arr.size
+    if total_q == 0 or n == 0:
+        return np.zeros(n, dtype=int), np.zeros(n)
+    correct = (det_mat == key_arr).sum(axis=1)
+    scores = np.round(correct / total_q * 20.0, 2)
+    return correct, scores
+
+
+def process_one(filename, pdf_bytes, answer_key, ocr_workers=OCR_WORKERS):
+    """Detecta las respuestas de un PDF. La nota se calcula luego en bloque con score_matrix.
+    'complete' indica si el resultado puede cachearse (ver detect_pdf_answers).
+    """
+    detected, complete = detect_pdf_answers(pdf_bytes, answer_key, ocr_workers)
+    return {'filename': filename, 'detected': detected, 'complete': complete}